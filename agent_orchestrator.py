@@ -1,16 +1,29 @@
+import logging
+import asyncio
+import operator
+import re
+import httpx
+import numpy as np
+from contextlib import asynccontextmanager
 from typing import Annotated, TypedDict, Optional
 from datetime import datetime
+from uuid import uuid4
 from langgraph.graph import StateGraph, END
 from langgraph.graph.message import add_messages
+from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver # Required: pip install langgraph-checkpoint-sqlite
 from langchain_core.messages import HumanMessage, SystemMessage
 from pydantic import BaseModel
-from ai_service import policy_db, claims_db, evaluations_db, llm
+from ai_service import policy_db, claims_db, audit_queue, write_audit_record, llm, ollama_client
+from vector_store import cached_similarity_search
+
+logger = logging.getLogger(__name__)
 
 # Request Schema
 class InvestigationRequest(BaseModel):
     client_id: str
     submission_date: str
     question: Optional[str] = None
+    instance_id: Optional[str] = None # Re-POST an existing ID to resume from its checkpoint
 
 # Shared State
 class AgentState(TypedDict):
@@ -19,83 +32,151 @@ class AgentState(TypedDict):
     submission_date: str
     instance_id: str
     policy_category: str
-    policy_context: str
-    risk_score: int
+    risk_score: Annotated[int, operator.add] # Parallel nodes contribute partial scores
     compliance_report: str
     final_verdict: str
 
+# Static SOP prefix: kept byte-identical and at the start of the prompt so
+# Ollama can reuse its KV-cache across investigations.
+COMPLIANCE_RULES = "1. 30-day submission limit. 2. VAT Invoice for >2000 AED. 3. Police Report for accidents."
+COMPLIANCE_PREFIX = f"Apply Rules:\n{COMPLIANCE_RULES}\n\n"
+
+async def warm_up_llm():
+    """
+    Loads the model at startup and prefills the templated COMPLIANCE_PREFIX, so the
+    runner's prefix cache already holds the rules when the first compliance prompt
+    (same prefix + claim) arrives. Only one token is generated.
+    """
+    try:
+        await ollama_client.generate(
+            model=llm.model,
+            prompt=COMPLIANCE_PREFIX,
+            keep_alive=llm.keep_alive,
+            options={"num_ctx": llm.num_ctx, "temperature": llm.temperature, "num_predict": 1}
+        )
+    except (httpx.ConnectError, ConnectionError) as e:
+        # Ollama not running yet: expected at startup, no traceback needed
+        logger.warning(f"LLM warm-up skipped, Ollama unreachable: {e}")
+    except Exception:
+        logger.warning("LLM warm-up failed; model will load on first request.", exc_info=True)
+
+# The orchestrator only needs the conclusion of the compliance report, not all of it
+REPORT_TAIL_CHARS = 256
+
+# Keyword rulebooks for LLM-response triage: each distinct keyword found
+# (case-insensitive substring) adds its weight once. Each keyword has its own
+# compiled pattern, so overlapping keys ('fraud'/'fraudulent') all count, and the
+# response is searched without lower()-copying it; the score is a hit-vector .
+# weight-vector product, so new rules are just new entries.
+HISTORY_KEYWORDS = {"suspicious": 25}
+COMPLIANCE_KEYWORDS = {"violation": 40}
+
+def _rulebook(keywords):
+    # IGNORECASE also matches Unicode variants (e.g. 'ſ', 'İ') that lower() would miss
+    names = list(keywords)
+    return {
+        "patterns": [re.compile(re.escape(name), re.IGNORECASE) for name in names],
+        "weights": np.array([keywords[name] for name in names], dtype=np.float32)
+    }
+
+HISTORY_RULEBOOK = _rulebook(HISTORY_KEYWORDS)
+COMPLIANCE_RULEBOOK = _rulebook(COMPLIANCE_KEYWORDS)
+
+def keyword_hits(text, rulebook):
+    """0/1 indicator vector: which rulebook keywords occur in text."""
+    return np.array(
+        [1.0 if pattern.search(text) else 0.0 for pattern in rulebook["patterns"]],
+        dtype=rulebook["weights"].dtype
+    )
+
+def score(hits, weights):
+    return int(np.dot(hits, weights))
+
+def _log_prompt_size(node, prompt):
+    logger.debug(f"{node} prompt: {len(prompt.split())} words")
+
 # --- NODES ---
 
-def initialization_node(state: AgentState):
+async def initialization_node(state: AgentState):
     """
-    NEW NODE: Injects the investigation start log immediately into the
-    evaluation_audit_log collection.
+    NEW NODE: Queues the investigation start log for the
+    evaluation_audit_log collection (flushed in batches by ai_service.audit_flusher).
     """
-    evaluations_db.add_texts(
-        texts=[f"Investigation started for client {state['client_id']}."],
-        metadatas=[{
+    await audit_queue.put((
+        uuid4().hex,
+        f"Investigation started for client {state['client_id']}.",
+        {
             "client_id": state["client_id"],
             "instance_id": state["instance_id"],
             "submission_date": state["submission_date"],
             "status": "In_Progress",
             "start_time": datetime.now().isoformat()
-        }]
-    )
+        },
+        None  # Start marker is fire-and-forget; batching it is safe
+    ))
     return {"messages": [SystemMessage(content=f"Audit Log Initialized for Instance: {state['instance_id']}")]}
 
 def policy_selector_node(state: AgentState):
     """Node 1: Retrieves specific policy context."""
     query = state["messages"][0].content
-    docs = policy_db.similarity_search(query, k=3)
+    docs = cached_similarity_search(policy_db, query, k=3)
     category = docs[0].metadata.get("document_category", "General") if docs else "General"
     return {
         "policy_category": category,
-        "policy_context": "\n".join([d.page_content for d in docs]),
         "messages": [SystemMessage(content=f"Context fetched for category: {category}")]
     }
 
-def history_investigator_node(state: AgentState):
+async def history_investigator_node(state: AgentState):
     """Node 2: Checks past transactions for patterns."""
-    past_docs = claims_db.similarity_search(
-        state["submission_date"], 
-        k=5, 
-        filter={"client_id": state["client_id"]}
+    # The client_id filter is highly selective and a date string carries no useful
+    # semantics, so read the client's claims by metadata and skip the ANN search.
+    past_docs = await asyncio.to_thread(
+        claims_db.get,
+        where={"client_id": state["client_id"]},
+        limit=5,
+        include=["documents"]
     )
-    history = "\n".join([d.page_content for d in past_docs]) if past_docs else "No history."
+    history = "\n".join(past_docs["documents"]) if past_docs["documents"] else "No history."
     prompt = f"Analyze claim history for {state['client_id']}:\n{history}"
-    analysis = llm.invoke(prompt)
-    risk = 25 if "suspicious" in analysis.lower() else 0
-    return {"risk_score": state["risk_score"] + risk, "messages": [SystemMessage(content="History analyzed.")]}
+    _log_prompt_size("investigator", prompt)
+    analysis = await llm.ainvoke(prompt)
+    risk = score(keyword_hits(analysis, HISTORY_RULEBOOK), HISTORY_RULEBOOK["weights"])
+    return {"risk_score": risk, "messages": [SystemMessage(content="History analyzed.")]}
 
-def compliance_evaluator_node(state: AgentState):
+async def compliance_evaluator_node(state: AgentState):
     """Node 3: Organization Specific Validation (Custom SOPs)."""
-    rules = "1. 30-day submission limit. 2. VAT Invoice for >2000 AED. 3. Police Report for accidents."
-    prompt = f"Apply Rules:\n{rules}\n\nClaim Context: {state['messages'][0].content}"
-    report = llm.invoke(prompt)
-    risk = 40 if "violation" in report.lower() else 0
-    return {"compliance_report": report, "risk_score": state["risk_score"] + risk}
+    prompt = f"{COMPLIANCE_PREFIX}Claim Context: {state['messages'][0].content}"
+    _log_prompt_size("compliance", prompt)
+    report = await llm.ainvoke(prompt)
+    risk = score(keyword_hits(report, COMPLIANCE_RULEBOOK), COMPLIANCE_RULEBOOK["weights"])
+    return {"compliance_report": report, "risk_score": risk}
 
-def orchestrator_node(state: AgentState):
+async def orchestrator_node(state: AgentState):
     """Node 4: Final Synthesis."""
-    summary = f"Risk: {state['risk_score']}\nCompliance: {state['compliance_report']}"
-    verdict = llm.invoke(f"Provide final APPROVED/DENIED verdict based on:\n{summary}")
+    summary = f"Risk: {state['risk_score']}\nCompliance: {state['compliance_report'][-REPORT_TAIL_CHARS:]}"
+    prompt = f"Provide final APPROVED/DENIED verdict based on:\n{summary}"
+    _log_prompt_size("orchestrator", prompt)
+    verdict = await llm.ainvoke(prompt)
     return {"final_verdict": verdict}
 
-def evaluation_archiver_node(state: AgentState):
+async def evaluation_archiver_node(state: AgentState):
     """
     Node 5: Permanent Storage of FINAL result in evaluation_audit_log.
     This effectively updates or appends the final verdict to the audit trail.
+    Waits for the batched write: if it fails, the node fails and stays pending in
+    the checkpoint, so a resume re-runs it instead of reporting a lost verdict.
     """
-    evaluations_db.add_texts(
-        texts=[f"Verdict: {state['final_verdict']}\nReport: {state['compliance_report']}"],
-        metadatas=[{
+    await write_audit_record(
+        uuid4().hex,
+        f"Verdict: {state['final_verdict']}\nReport: {state['compliance_report']}",
+        {
             "client_id": state["client_id"],
             "instance_id": state["instance_id"],
             "submission_date": state["submission_date"],
             "status": "Completed",
             "risk_score": state["risk_score"],
             "completion_time": datetime.now().isoformat()
-        }]
+        }
     )
     return {"messages": [SystemMessage(content="Final result archived to Audit Log.")]}
 
@@ -112,11 +193,33 @@ workflow.add_node("archiver", evaluation_archiver_node)
 
 # Set Flow
 workflow.set_entry_point("initializer") # New Start Point
+# Fan out: selector, investigator and compliance only read the initial message
 workflow.add_edge("initializer", "selector")
-workflow.add_edge("selector", "investigator")
-workflow.add_edge("investigator", "compliance")
-workflow.add_edge("compliance", "orchestrator")
+workflow.add_edge("initializer", "investigator")
+workflow.add_edge("initializer", "compliance")
+# Fan in: orchestrator waits for all three branches
+workflow.add_edge(["selector", "investigator", "compliance"], "orchestrator")
 workflow.add_edge("orchestrator", "archiver")
 workflow.add_edge("archiver", END)
 
-agent_system = workflow.compile()
\ No newline at end of file
+agent_system = workflow.compile()
+
+# Graph topology is fixed after compile, so render the preview diagram once
+MERMAID_CHART = agent_system.get_graph().draw_mermaid()
+
+# Checkpoint every super-step per thread_id (= instance_id) so a retried or restarted
+# investigation resumes after its last completed node instead of re-running LLM calls.
+CHECKPOINT_PATH = r"D:\pY\InsuranceRAG\langgraph.db"
+
+@asynccontextmanager
+async def checkpointing():
+    """
+    Attaches a SQLite checkpointer to agent_system for the lifetime of the app.
+    AsyncSqliteSaver needs a running event loop, so enter this from a startup hook.
+    """
+    async with AsyncSqliteSaver.from_conn_string(CHECKPOINT_PATH) as saver:
+        agent_system.checkpointer = saver
+        try:
+            yield saver
+        finally:
+            agent_system.checkpointer = None
@@ -1,53 +1,124 @@
 import os
-import chromadb
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
 from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel
 from pathlib import Path
 
 # Modern LangChain 0.3+ / 1.0 Imports
 from langchain_ollama import OllamaLLM
-from langchain_huggingface import HuggingFaceEmbeddings
-from langchain_chroma import Chroma
+from ollama import AsyncClient
 from langchain_classic.chains import create_retrieval_chain
 from langchain_classic.chains.combine_documents import create_stuff_documents_chain
 from langchain_core.prompts import ChatPromptTemplate
 
-# 1. Configuration & Paths
-CHROMA_PATH = r"D:\pY\InsuranceRAG\local_db"
-router = APIRouter(tags=["AI Interaction"])
+# Shared Chroma collections (one instance per process)
+from vector_store import (
+    POLICY_DB as policy_db,
+    CLAIMS_DB as claims_db,
+    EVALUATIONS_DB as evaluations_db,
+    acached_similarity_search
+)
 
-# 2. Initialize Chroma Client (Shared with main.py for Audit Queries)
-# This is what allows your preview flow to query by instance_id
-client = chromadb.PersistentClient(path=CHROMA_PATH)
+# 1. Configuration
+router = APIRouter(tags=["AI Interaction"])
+logger = logging.getLogger(__name__)
 
-# 3. Initialize Shared AI Components
-embeddings = HuggingFaceEmbeddings(model_name="all-MiniLM-L6-v2")
+# 2. Initialize Shared AI Components
+# All callers use llm.ainvoke, so concurrent investigations reach Ollama together.
+# Start the Ollama server with OLLAMA_NUM_PARALLEL=4 and OLLAMA_MAX_LOADED_MODELS=1
+# so it batches those requests against a single resident model.
 llm = OllamaLLM(
     model="llama3:8b-instruct-q2_K",
     num_ctx=2048,  # Limits memory spike
-    temperature=0.1
+    temperature=0.1,
+    keep_alive="1h"  # Keeps the model (and shared prompt prefix) resident between calls
 )
 
-# Initialize TWO separate collections
-policy_db = Chroma(
-    persist_directory=CHROMA_PATH, 
-    embedding_function=embeddings, 
-    collection_name="policy_master_collection"
-)
+# Raw Ollama client for calls that need /api/generate options OllamaLLM doesn't
+# expose per call (e.g. num_predict=1 for the warm-up); same server as llm.
+ollama_client = AsyncClient(host=llm.base_url)
 
-claims_db = Chroma(
-    persist_directory=CHROMA_PATH, 
-    embedding_function=embeddings, 
-    collection_name="claims_collection"
-)
+# Thread pools for blocking work. CPU_POOL becomes the event loop's default executor
+# on startup, so LangChain's a* fallbacks (asimilarity_search, aadd_texts, ...) run
+# embedding + Chroma work there; IO_POOL serves sync Chroma admin and disk calls.
+CPU_POOL = ThreadPoolExecutor(max_workers=4, thread_name_prefix="cpu-pool")
+IO_POOL = ThreadPoolExecutor(max_workers=8, thread_name_prefix="io-pool")
 
-evaluations_db = Chroma(
-    persist_directory=CHROMA_PATH, 
-    embedding_function=embeddings, 
-    collection_name="evaluation_audit_log"
-)
+# Audit writes are queued as (id, text, metadata, future) and flushed to Chroma in
+# batches, so N investigations cost N/64 embedding + write round-trips instead of 2N.
+# future is None for fire-and-forget records; write_audit_record() passes one and
+# waits on it, so callers that must not lose their record see the write fail.
+AUDIT_BATCH_SIZE = 64
+AUDIT_FLUSH_INTERVAL = 0.2  # seconds
+AUDIT_WRITE_RETRIES = 3  # ids are fixed at enqueue time, so re-writing a batch is idempotent
+AUDIT_DRAIN_TIMEOUT = 10  # seconds allowed on shutdown to flush what is still queued
+audit_queue: asyncio.Queue = asyncio.Queue(maxsize=1024)
+
+async def audit_flusher():
+    """Background task (started on app startup) draining audit_queue into evaluations_db."""
+    loop = asyncio.get_running_loop()
+    while True:
+        batch = [await audit_queue.get()]
+        deadline = loop.time() + AUDIT_FLUSH_INTERVAL
+        while len(batch) < AUDIT_BATCH_SIZE:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(audit_queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+
+        error = None
+        try:
+            error = await _write_audit_batch(batch)
+        except BaseException as e:  # e.g. cancelled on shutdown mid-write
+            error = e
+            raise
+        finally:
+            for *_, future in batch:
+                if future is not None and not future.done():
+                    if error is None:
+                        future.set_result(None)
+                    else:
+                        future.set_exception(RuntimeError(f"Audit write failed: {error!r}"))
+            for _ in batch:
+                audit_queue.task_done()
+
+async def _write_audit_batch(batch):
+    """Writes one batch, retrying with backoff. Returns the last error, or None on success."""
+    ids = [record[0] for record in batch]
+    texts = [record[1] for record in batch]
+    metadatas = [record[2] for record in batch]
+    for attempt in range(1, AUDIT_WRITE_RETRIES + 1):
+        try:
+            await evaluations_db.aadd_texts(texts=texts, metadatas=metadatas, ids=ids)
+            return None
+        except Exception as e:
+            if attempt == AUDIT_WRITE_RETRIES:
+                logger.error(f"Audit write of {len(batch)} records failed after {attempt} attempts: {ids}", exc_info=True)
+                return e
+            logger.warning(f"Audit write failed (attempt {attempt}/{AUDIT_WRITE_RETRIES}): {e}; retrying.")
+            await asyncio.sleep(0.5 * 2 ** (attempt - 1))
+
+async def write_audit_record(record_id, text, metadata):
+    """Queues one record and waits until the flusher has durably written it (raises if not)."""
+    future = asyncio.get_running_loop().create_future()
+    await audit_queue.put((record_id, text, metadata, future))
+    await future
+
+async def drain_audit_queue(flusher_task):
+    """Shutdown hook: waits (bounded) for queued audit records to be written, then stops the flusher."""
+    try:
+        await asyncio.wait_for(audit_queue.join(), AUDIT_DRAIN_TIMEOUT)
+    except asyncio.TimeoutError:
+        logger.error(f"Shutdown with {audit_queue.qsize()} audit records still unwritten.")
+    finally:
+        flusher_task.cancel()
 
-# 4. Request Schemas
+# 3. Request Schemas
 class QueryRequest(BaseModel):
     question: str
     client_id: str = "Company"
@@ -67,7 +138,7 @@ async def ask_policy(request: QueryRequest):
     chain = create_retrieval_chain(retriever, create_stuff_documents_chain(llm, prompt))
     
     try:
-        response = chain.invoke({"input": request.question})
+        response = await chain.ainvoke({"input": request.question})
         return {"answer": response["answer"]}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -82,12 +153,15 @@ async def evaluate_claim(request: QueryRequest):
     )
     prompt = ChatPromptTemplate.from_messages([("system", system_prompt), ("human", "{input}")])
 
-    # 1. Manually fetch context from both collections
-    policy_context = policy_db.similarity_search(request.question, k=3)
-    claim_context = claims_db.similarity_search(
-        request.question, 
-        k=3, 
-        filter={"client_id": request.client_id}
+    # 1. Manually fetch context from both collections (concurrently)
+    policy_context, claim_context = await asyncio.gather(
+        acached_similarity_search(policy_db, request.question, k=3),
+        acached_similarity_search(
+            claims_db,
+            request.question, 
+            k=3, 
+            filt={"client_id": request.client_id}
+        )
     )
     
     # 2. Combine for the Chain
@@ -97,7 +171,7 @@ async def evaluate_claim(request: QueryRequest):
     
     try:
         # We bypass create_retrieval_chain here to control the context precisely
-        response = stuff_chain.invoke({
+        response = await stuff_chain.ainvoke({
             "input": request.question,
             "context": combined_docs
         })
@@ -0,0 +1,109 @@
+import os
+import sqlite3
+import time
+from contextlib import closing
+from datetime import datetime
+import psutil
+
+# Live progress for /ask/investigate/async runs. Backed by SQLite (WAL mode) so every
+# uvicorn worker on the host sees the same state; records expire after TRACKER_TTL.
+TRACKER_PATH = r"D:\pY\InsuranceRAG\instance_tracker.db"
+TRACKER_TTL = 3600  # seconds
+
+# Identifies the worker process running an instance; create_time guards against PID reuse
+OWNER_PID = os.getpid()
+OWNER_STARTED = psutil.Process(OWNER_PID).create_time()
+
+def _owner_alive(pid, started):
+    try:
+        return pid is not None and abs(psutil.Process(pid).create_time() - started) < 1
+    except psutil.NoSuchProcess:
+        return False
+
+class InstanceTracker:
+    """
+    Process-safe replacement for the old in-memory instance_tracker dict.
+    All methods block on SQLite; call them through main.run_io.
+    """
+
+    def __init__(self, path=TRACKER_PATH, ttl=TRACKER_TTL):
+        self.path = path
+        self.ttl = ttl
+        with closing(self._connect()) as conn, conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS instances ("
+                "instance_id TEXT PRIMARY KEY, status TEXT, client_id TEXT, "
+                "submission_date TEXT, start_time TEXT, expires_at REAL, "
+                "owner_pid INTEGER, owner_started REAL)"
+            )
+            # Trackers created before owner columns existed
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(instances)")}
+            for column, kind in (("owner_pid", "INTEGER"), ("owner_started", "REAL")):
+                if column not in columns:
+                    conn.execute(f"ALTER TABLE instances ADD COLUMN {column} {kind}")
+            conn.execute("CREATE TABLE IF NOT EXISTS steps (instance_id TEXT, node_name TEXT)")
+            conn.execute("CREATE INDEX IF NOT EXISTS steps_instance ON steps (instance_id)")
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=5)
+
+    def claim(self, instance_id, client_id, submission_date, resume=False):
+        """
+        Atomically marks the instance Running for this process and drops expired ones.
+        Returns False (and changes nothing) if a live process is already running it.
+        A fresh run clears old steps; a resume keeps the steps already completed.
+        """
+        now = time.time()
+        with closing(self._connect()) as conn, conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT status, owner_pid, owner_started FROM instances "
+                "WHERE instance_id = ? AND expires_at > ?", (instance_id, now)
+            ).fetchone()
+            if row and row[0] == "Running" and _owner_alive(row[1], row[2]):
+                return False
+
+            conn.execute(
+                "DELETE FROM steps WHERE instance_id IN "
+                "(SELECT instance_id FROM instances WHERE expires_at <= ?)", (now,)
+            )
+            conn.execute("DELETE FROM instances WHERE expires_at <= ?", (now,))
+            if not resume:
+                conn.execute("DELETE FROM steps WHERE instance_id = ?", (instance_id,))
+            conn.execute(
+                "INSERT OR REPLACE INTO instances "
+                "(instance_id, status, client_id, submission_date, start_time, expires_at, owner_pid, owner_started) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (instance_id, "Running", client_id, submission_date,
+                 datetime.now().isoformat(), now + self.ttl, OWNER_PID, OWNER_STARTED)
+            )
+            return True
+
+    def add_step(self, instance_id, node_name):
+        with closing(self._connect()) as conn, conn:
+            conn.execute("INSERT INTO steps VALUES (?, ?)", (instance_id, node_name))
+
+    def set_status(self, instance_id, status):
+        with closing(self._connect()) as conn, conn:
+            conn.execute("UPDATE instances SET status = ? WHERE instance_id = ?", (status, instance_id))
+
+    def get(self, instance_id):
+        """Returns the tracked record (with steps_completed) or None if unknown/expired."""
+        with closing(self._connect()) as conn:
+            row = conn.execute(
+                "SELECT status, client_id, submission_date, start_time FROM instances "
+                "WHERE instance_id = ? AND expires_at > ?", (instance_id, time.time())
+            ).fetchone()
+            if row is None:
+                return None
+            steps = conn.execute(
+                "SELECT node_name FROM steps WHERE instance_id = ? ORDER BY rowid", (instance_id,)
+            ).fetchall()
+        return {
+            "status": row[0],
+            "client_id": row[1],
+            "submission_date": row[2],
+            "start_time": row[3],
+            "steps_completed": [step[0] for step in steps]
+        }
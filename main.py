@@ -1,34 +1,78 @@
 import os
 import uuid
+import asyncio
 import shutil
 import json
-import chromadb
+import functools
+from contextlib import AsyncExitStack
+import aiofiles # Required: pip install aiofiles
 from datetime import datetime
 from pathlib import Path
 from fastapi import FastAPI, UploadFile, File, HTTPException, BackgroundTasks
 from fastapi.responses import JSONResponse, HTMLResponse
+from chromadb.errors import NotFoundError
 from langchain_core.messages import HumanMessage
 
 # 1. Connect the AI service logic
-from ai_service import router as ai_router
+from ai_service import router as ai_router, audit_flusher, drain_audit_queue, CPU_POOL, IO_POOL
 
-# 2. Connect the Multi-Agent Orchestrator components
-from agent_orchestrator import agent_system, InvestigationRequest
+# 2. Shared Chroma client (same instance the AI service uses)
+from vector_store import CHROMA_CLIENT as client, COLLECTION_HNSW, clear_search_cache
 
-# 3. The main app object
+# 3. Shared (cross-worker) progress store for async investigations
+from instance_tracker import InstanceTracker
+
+# 4. Connect the Multi-Agent Orchestrator components
+from agent_orchestrator import agent_system, InvestigationRequest, MERMAID_CHART, warm_up_llm, checkpointing
+
+# 5. The main app object
 app = FastAPI(title="Insurance Multi-Agent RAG API")
 
-# 4. Include the AI Router (Basic /ask endpoints)
+# 6. Include the AI Router (Basic /ask endpoints)
 app.include_router(ai_router)
 
-# 5. Define ABSOLUTE storage paths
+# 7. Define ABSOLUTE storage paths
 BASE_DIR = Path(r"D:\pY\InsuranceRAG\storage")
-CHROMA_PATH = r"D:\pY\InsuranceRAG\local_db"
 BASE_DIR.mkdir(parents=True, exist_ok=True)
 
-# 6. Initialize Chroma Client and In-Memory Instance Tracker
-client = chromadb.PersistentClient(path=CHROMA_PATH)
-instance_tracker = {} # Temporary store for live progress visualization
+AUDIT_PREVIEW_LIMIT = 100  # Max audit records rendered per preview
+
+# 8. Instance Tracker (SQLite-backed so all uvicorn workers share live progress)
+instance_tracker = InstanceTracker()
+
+@app.on_event("startup")
+async def configure_executors():
+    """Routes default run_in_executor work (LangChain async fallbacks) to CPU_POOL."""
+    asyncio.get_running_loop().set_default_executor(CPU_POOL)
+
+@app.on_event("startup")
+async def start_audit_flusher():
+    """Starts the batched writer for evaluation_audit_log records."""
+    app.state.audit_flusher = asyncio.create_task(audit_flusher())
+
+@app.on_event("shutdown")
+async def stop_audit_flusher():
+    """Flushes queued audit records (e.g. a just-archived verdict) before exiting."""
+    await drain_audit_queue(app.state.audit_flusher)
+
+@app.on_event("startup")
+async def open_checkpointer():
+    """Opens the LangGraph SQLite checkpointer inside the running loop."""
+    app.state.checkpoint_stack = AsyncExitStack()
+    await app.state.checkpoint_stack.enter_async_context(checkpointing())
+
+@app.on_event("shutdown")
+async def close_checkpointer():
+    await app.state.checkpoint_stack.aclose()
+
+@app.on_event("startup")
+async def preload_llm():
+    """Pins the Ollama model (keep_alive=1h) and pre-fills the compliance rules prefix."""
+    await warm_up_llm()
+
+async def run_io(func, *args, **kwargs):
+    """Runs a blocking Chroma/filesystem call on IO_POOL instead of the event loop."""
+    return await asyncio.get_running_loop().run_in_executor(IO_POOL, functools.partial(func, *args, **kwargs))
 
 @app.get("/")
 def read_root():
@@ -42,29 +86,42 @@ async def start_async_investigation(request: InvestigationRequest, background_ta
     Triggers an asynchronous investigation instance. 
     Returns an Instance ID and a URL to verify the visual flow and results.
     """
-    instance_id = str(uuid.uuid4())
+    instance_id = request.instance_id or str(uuid.uuid4())
     verify_url = f"http://127.0.0.1:8000/verify/flow/{instance_id}"
+
+    # An existing instance_id resumes from its LangGraph checkpoint (if its last
+    # run failed or its worker died); a run that is still in flight is left alone
+    resume = False
+    if request.instance_id:
+        snapshot = await agent_system.aget_state({"configurable": {"thread_id": instance_id}})
+        if snapshot.values and not snapshot.next:
+            return {
+                "instance_id": instance_id,
+                "verification_url": verify_url,
+                "message": "Investigation instance already completed."
+            }
+        resume = bool(snapshot.values)
     
-    # Initialize the tracker for this instance
-    instance_tracker[instance_id] = {
-        "status": "Running",
-        "client_id": request.client_id,
-        "submission_date": request.submission_date,
-        "start_time": datetime.now().isoformat(),
-        "steps_completed": []
-    }
+    # Claim the instance in the tracker; fails if a live worker is already running it
+    claimed = await run_io(instance_tracker.claim, instance_id, request.client_id, request.submission_date, resume)
+    if not claimed:
+        return {
+            "instance_id": instance_id,
+            "verification_url": verify_url,
+            "message": "Investigation instance is already running."
+        }
 
     # Add the agent execution to background tasks
-    background_tasks.add_task(run_agent_background_task, instance_id, request)
+    background_tasks.add_task(run_agent_background_task, instance_id, request, resume)
 
     return {
         "instance_id": instance_id,
         "verification_url": verify_url,
-        "message": "Investigation instance triggered successfully."
+        "message": "Investigation instance resumed from checkpoint." if resume else "Investigation instance triggered successfully."
     }
 
-async def run_agent_background_task(instance_id: str, request: InvestigationRequest):
-    """Background worker to execute the LangGraph workflow."""
+async def run_agent_background_task(instance_id: str, request: InvestigationRequest, resume: bool = False):
+    """Background worker to execute the LangGraph workflow (or resume it from its checkpoint)."""
     try:
         user_input = request.question if request.question else f"Perform full audit for submission on {request.submission_date}"
         
@@ -80,33 +137,44 @@ async def run_agent_background_task(instance_id: str, request: InvestigationRequ
         }
         
         # Stream the graph execution to track progress per node
-        async for event in agent_system.astream(initial_state, config=config):
+        # A None input tells LangGraph to continue the thread from its last checkpoint
+        graph_input = None if resume else initial_state
+        async for event in agent_system.astream(graph_input, config=config):
             for node_name, _ in event.items():
-                instance_tracker[instance_id]["steps_completed"].append(node_name)
+                await run_io(instance_tracker.add_step, instance_id, node_name)
         
-        instance_tracker[instance_id]["status"] = "Completed"
+        await run_io(instance_tracker.set_status, instance_id, "Completed")
     except Exception as e:
-        instance_tracker[instance_id]["status"] = f"Failed: {str(e)}"
+        await run_io(instance_tracker.set_status, instance_id, f"Failed: {str(e)}")
 
 @app.get("/preview/flow/{instance_id}", response_class=HTMLResponse, tags=["Multi-Agent Intelligence"])
 async def preview_flow_visual(instance_id: str):
     
-    # 1. Query the permanent collection first
+    # 1. Live progress from the shared tracker (any worker may have started it)
+    tracked = await run_io(instance_tracker.get, instance_id)
+
+    # 2. Query the permanent collection for the audit timeline
     try:
-        audit_col = client.get_collection("evaluation_audit_log")
-        db_records = audit_col.get(where={"instance_id": instance_id})
-    except Exception:
+        audit_col = await run_io(client.get_collection, "evaluation_audit_log")
+        # Skip embeddings (never rendered) and bound pathological audit trails
+        db_records = await run_io(
+            audit_col.get,
+            where={"instance_id": instance_id},
+            include=["documents", "metadatas"],
+            limit=AUDIT_PREVIEW_LIMIT
+        )
+    except NotFoundError:
         # If the collection doesn't exist yet, it's definitely a 404
         raise HTTPException(status_code=404, detail="Audit collection not initialized.")
 
-    # 2. Hard 404 ONLY if not found in the Database
-    if not db_records or not db_records['documents']:
+    # 3. Hard 404 ONLY if neither the tracker nor the Database knows the instance
+    if not tracked and (not db_records or not db_records['documents']):
         raise HTTPException(status_code=404, detail=f"No record found for Instance ID: {instance_id}")
 
     # --- DATA PROCESSING ---
     # Combine all related documents for this instance into a timeline view
     full_history = []
-    latest_metadata = {}
+    latest_metadata = {"client_id": tracked["client_id"]} if tracked else {}
     
     for doc, meta in zip(db_records['documents'], db_records['metadatas']):
         full_history.append({
@@ -120,13 +188,13 @@ async def preview_flow_visual(instance_id: str):
     # Determine current status for the refresh logic
     status = "Historical"
     completed_steps = []
-    if instance_id in instance_tracker:
-        status = instance_tracker[instance_id]["status"]
-        completed_steps = instance_tracker[instance_id]["steps_completed"]
+    if tracked:
+        status = tracked["status"]
+        completed_steps = tracked["steps_completed"]
     else:
         status = latest_metadata.get("status", "Completed")
 
-    mermaid_chart = agent_system.get_graph().draw_mermaid()
+    mermaid_chart = MERMAID_CHART
 
     # --- HTML RENDERING ---
     history_html = "".join([
@@ -174,6 +242,14 @@ async def preview_flow_visual(instance_id: str):
 
 # --- STORAGE ENDPOINTS ---
 
+UPLOAD_CHUNK_SIZE = 1 << 20  # 1 MiB
+
+async def save_upload(file: UploadFile, file_path: Path):
+    """Streams the upload to disk chunk by chunk without blocking the event loop."""
+    async with aiofiles.open(file_path, "wb") as out:
+        while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+            await out.write(chunk)
+
 @app.post("/upload/policy", tags=["Storage Management"])
 async def upload_policy(category: str, file: UploadFile = File(...)):
     category = category.strip().capitalize()
@@ -185,8 +261,7 @@ async def upload_policy(category: str, file: UploadFile = File(...)):
     target_folder.mkdir(parents=True, exist_ok=True)
     
     file_path = target_folder / file.filename
-    with open(file_path, "wb") as buffer:
-        buffer.write(await file.read())
+    await save_upload(file, file_path)
             
     return {"message": "Policy uploaded", "category": category, "path": str(file_path)}
 
@@ -198,26 +273,32 @@ async def upload_claim(client_id: str, submission_type: str, file: UploadFile =
     target_folder.mkdir(parents=True, exist_ok=True)
     
     file_path = target_folder / file.filename
-    with open(file_path, "wb") as buffer:
-        buffer.write(await file.read())
+    await save_upload(file, file_path)
             
     return {"message": "Claim submitted", "path": str(file_path)}
 
 # --- DATABASE MANAGEMENT ---
 
+def delete_where(collection, where):
+    """Resolves matching ids with an id-only get, then deletes through the id index."""
+    ids = collection.get(where=where, include=[])["ids"]
+    if ids:
+        collection.delete(ids=ids)
+
 @app.delete("/clear-all", tags=["Database Management"])
 async def clear_all_data():
     try:
         # Clear all three dual database collections
-        for name in ["policy_master_collection", "claims_collection", "evaluation_audit_log"]:
+        for name, hnsw_metadata in COLLECTION_HNSW.items():
             try:
-                client.delete_collection(name=name)
-            except:
-                pass
-            client.create_collection(name=name)
+                await run_io(client.delete_collection, name=name)
+            except NotFoundError:
+                pass # Nothing to delete yet
+            await run_io(client.create_collection, name=name, metadata=hnsw_metadata)
+        clear_search_cache()
         
         if BASE_DIR.exists():
-            shutil.rmtree(BASE_DIR)
+            await run_io(shutil.rmtree, BASE_DIR)
             BASE_DIR.mkdir(parents=True, exist_ok=True)
             
         return {"message": "All database collections and physical storage cleared."}
@@ -227,16 +308,17 @@ async def clear_all_data():
 @app.delete("/delete-client/{client_id}", tags=["Database Management"])
 async def delete_client_data(client_id: str):
     try:
-        claims_col = client.get_collection(name="claims_collection")
-        claims_col.delete(where={"client_id": client_id})
+        claims_col = await run_io(client.get_collection, name="claims_collection")
+        await run_io(delete_where, claims_col, {"client_id": client_id})
         
         # Also clean audit logs for this client
-        audit_col = client.get_collection(name="evaluation_audit_log")
-        audit_col.delete(where={"client_id": client_id})
+        audit_col = await run_io(client.get_collection, name="evaluation_audit_log")
+        await run_io(delete_where, audit_col, {"client_id": client_id})
+        clear_search_cache()
         
         client_folder = BASE_DIR / "claims" / client_id
         if client_folder.exists():
-            shutil.rmtree(client_folder)
+            await run_io(shutil.rmtree, client_folder)
             
         return {"message": f"Data for {client_id} removed from all records."}
     except Exception as e:
@@ -1,12 +1,14 @@
 import os
+import asyncio
 import logging
+import threading
 import time
 import shutil
+import httpx
 from watchdog.observers.read_directory_changes import WindowsApiObserver as Observer
 from watchdog.events import PatternMatchingEventHandler
-from langchain_huggingface import HuggingFaceEmbeddings
-from langchain_chroma import Chroma
-from langchain_community.document_loaders import PyMuPDFLoader
+import fitz # PyMuPDF
+from langchain_core.documents import Document
 from langchain_experimental.text_splitter import SemanticChunker # Required: pip install langchain_experimental
 from langchain_ollama import OllamaLLM
 
@@ -20,11 +22,16 @@ logger = logging.getLogger(__name__)
 
 # 2. Initialize Components
 logger.info("⚙️ Initializing RAG Components with Semantic Logic...")
-embeddings = HuggingFaceEmbeddings(model_name="all-MiniLM-L6-v2")
-llm = OllamaLLM(model="llama3:8b-instruct-q2_K", num_ctx=2048, temperature=0)
+# Embeddings and collections come from vector_store.py (batched ONNX encoder,
+# which SemanticChunker also uses for its sentence embeddings). Imported after
+# logging is configured so model/Chroma start-up lands in processor_debug.log.
+from vector_store import EMBEDDINGS as embeddings, POLICY_DB as policy_db, CLAIMS_DB as claims_db, acached_similarity_search
+llm = OllamaLLM(model="llama3:8b-instruct-q2_K", num_ctx=2048, temperature=0, keep_alive="1h")
 
-policy_db = Chroma(persist_directory=r"D:\pY\InsuranceRAG\local_db", embedding_function=embeddings, collection_name="policy_master_collection")
-claims_db = Chroma(persist_directory=r"D:\pY\InsuranceRAG\local_db", embedding_function=embeddings, collection_name="claims_collection")
+# Pipeline tuning: bounded queues give backpressure between stages, and the
+# embedder coalesces chunks from several files into one add_documents call.
+PIPELINE_QUEUE_SIZE = 8
+EMBED_BATCH_SIZE = 32
 
 class IngestionHandler(PatternMatchingEventHandler):
     def __init__(self):
@@ -41,8 +48,28 @@ class IngestionHandler(PatternMatchingEventHandler):
             embeddings, 
             breakpoint_threshold_type="percentile" 
         )
+
+        # Watchdog callbacks run on the observer thread; the ingestion pipeline
+        # (load -> classify/chunk -> embed) runs on its own background event loop.
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(target=self.loop.run_forever, name="ingestion-pipeline", daemon=True).start()
+        asyncio.run_coroutine_threadsafe(self.start_pipeline(), self.loop).result()
         logger.info("🏠 Handler initialized with Semantic Chunking enabled.")
 
+    async def start_pipeline(self):
+        self.load_queue = asyncio.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+        self.classify_queue = asyncio.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+        self.embed_queue = asyncio.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+        self.workers = [
+            asyncio.create_task(self.loader_worker()),
+            asyncio.create_task(self.classifier_worker()),
+            asyncio.create_task(self.embedder_worker())
+        ]
+
+    # on_closed fires once the writer releases the file (inotify observers);
+    # ReadDirectoryChangesW never emits it, so created/modified stay as the
+    # Windows trigger and the 5s de-dup below collapses the duplicates.
+    def on_closed(self, event): self.handle_event(event)
     def on_created(self, event): self.handle_event(event)
     def on_modified(self, event): self.handle_event(event)
 
@@ -53,75 +80,203 @@ class IngestionHandler(PatternMatchingEventHandler):
             
         self.processed_cache[event.src_path] = now
         logger.info(f"FILE DETECTED: {os.path.basename(event.src_path)}")
-        self.process_pdf(event.src_path)
+        # Blocks the observer thread while the load queue is full (backpressure)
+        asyncio.run_coroutine_threadsafe(self.load_queue.put(event.src_path), self.loop).result()
 
-    def classify_claim_type(self, sample_text, filename):
-        policy_info = policy_db.similarity_search("Claim categories", k=3)
+    async def classify_claim_type(self, sample_text, filename):
+        policy_info = await acached_similarity_search(policy_db, "Claim categories", k=3)
         context = "\n".join([d.page_content for d in policy_info])
         prompt = f"Context: {context}\n\nClaim: {sample_text}\n\nOutput ONLY the category name:"
-        return llm.invoke(prompt).strip()
+        return (await llm.ainvoke(prompt)).strip()
 
-    def wait_for_file_release(self, file_path, retries=10, delay=1):
+    def claim_file(self, file_path, temp_path, retries=8, base_delay=0.05):
+        """
+        Claims the file by renaming it to temp_path, with exponential backoff
+        (50ms .. 3.2s, ~6s total). The rename fails while a writer still holds the
+        file, which a read-open probe would not detect on Windows.
+        """
         for i in range(retries):
             try:
-                os.rename(file_path, file_path)
+                os.rename(file_path, temp_path)
                 return True
+            except FileNotFoundError:
+                return False # Already claimed by an earlier event
             except OSError:
-                logger.warning(f"⏳ File '{os.path.basename(file_path)}' is busy. Retrying {i+1}/{retries}...")
-                time.sleep(delay)
+                if i == retries - 1:
+                    break
+                logger.debug(f"⏳ File '{os.path.basename(file_path)}' is busy. Retrying {i+1}/{retries}...")
+                time.sleep(base_delay * (2 ** i))
+        # Let the writer's next modified/closed event re-trigger ingestion
+        self.processed_cache.pop(file_path, None)
         return False
 
-    def process_pdf(self, file_path):
+    def load_pdf(self, file_path):
+        """Stage 1 (worker thread): claims the file, opens it and extracts only page 0 for classification."""
         filename = os.path.basename(file_path)
-        
-        if not self.wait_for_file_release(file_path):
-            logger.error(f"❌ Could not access {filename}. OS still holding lock.")
-            return
+        parts = os.path.normpath(file_path).split(os.sep)
+        job = {
+            "file_path": file_path,
+            "temp_path": file_path + ".ingesting",
+            "filename": filename,
+            "parts": parts,
+            "is_claim": "claims" in parts
+        }
+        if not self.claim_file(file_path, job["temp_path"]):
+            if os.path.exists(file_path):
+                logger.warning(f"⚠️ Could not claim {filename}; OS still holding lock. Will retry on next file event.")
+            return None
 
-        temp_path = file_path + ".ingesting"
         try:
-            os.rename(file_path, temp_path)
             logger.info(f"🚀 Processing (Semantic): {filename}")
-            
-            parts = os.path.normpath(file_path).split(os.sep)
-            is_claim = "claims" in parts
-            
-            loader = PyMuPDFLoader(temp_path)
-            docs = loader.load()
-            
-            # --- SEMANTIC CHUNKING ---
-            # This looks at sentence embeddings and splits when the topic changes
-            chunks = self.semantic_splitter.split_documents(docs)
-            
-            # Classification
-            if is_claim:
-                category = self.classify_claim_type(docs[0].page_content[:1500] if docs else "", filename)
-            else:
-                category = parts[-3] 
-            
-            meta_data = {
-                "source_type": "Claim" if is_claim else "Policy",
-                "document_category": category,
-                "client_id": parts[-3] if is_claim else "Company",
-                "submission_date": parts[-2] if is_claim else "N/A",
-                "chunk_method": "semantic"
-            }
-
-            for chunk in chunks: 
-                chunk.metadata.update(meta_data)
-            
-            db = claims_db if is_claim else policy_db
-            db.add_documents(chunks)
-            
-            # Move to processed
-            processed_dir = os.path.join(os.path.dirname(file_path), "processed")
-            os.makedirs(processed_dir, exist_ok=True)
-            shutil.move(temp_path, os.path.join(processed_dir, filename))
-            logger.info(f"✅ Indexed {len(chunks)} semantic chunks for: {filename}")
-            
-        except Exception as e: 
-            logger.error(f"❌ Error processing {filename}:", exc_info=True)
-            if os.path.exists(temp_path): os.rename(temp_path, file_path)
+            job["pdf"] = fitz.open(job["temp_path"])
+            job["sample"] = job["pdf"][0].get_text()[:1500] if job["pdf"].page_count else ""
+            return job
+        except (OSError, fitz.FileDataError) as e:
+            # Expected in a busy drop folder (locks, half-written or corrupt PDFs): no traceback
+            logger.warning(f"⚠️ Could not load {filename}: {e}")
+            self.restore(job)
+            return None
+        except Exception:
+            logger.exception(f"❌ Unexpected error loading {filename}:")
+            self.restore(job)
+            return None
+
+    def iter_pages(self, job):
+        """Yields one Document per page so the full PDF text is never parsed up front."""
+        pdf = job["pdf"]
+        for page in pdf:
+            yield Document(
+                page_content=page.get_text(),
+                metadata={
+                    "source": job["temp_path"],
+                    "file_path": job["temp_path"],
+                    "page": page.number,
+                    "total_pages": pdf.page_count
+                }
+            )
+
+    def split_pdf(self, job):
+        """Streams pages into the semantic splitter, then releases the PDF handle."""
+        try:
+            return self.semantic_splitter.split_documents(self.iter_pages(job))
+        finally:
+            self.close_pdf(job)
+
+    def close_pdf(self, job):
+        # The open handle would block the rename/move on Windows
+        pdf = job.pop("pdf", None)
+        if pdf is not None: pdf.close()
+
+    def restore(self, job):
+        """Puts a failed file back under its original name so it can be retried."""
+        try:
+            self.close_pdf(job)
+            if os.path.exists(job["temp_path"]): os.rename(job["temp_path"], job["file_path"])
+        except OSError as e:
+            # Called from error handlers: a failed rename must not take the worker down
+            logger.warning(f"⚠️ Could not restore {job['filename']}; left as {os.path.basename(job['temp_path'])}: {e}")
+
+    def archive(self, job):
+        """Moves a fully indexed file into the sibling 'processed' folder."""
+        processed_dir = os.path.join(os.path.dirname(job["file_path"]), "processed")
+        os.makedirs(processed_dir, exist_ok=True)
+        shutil.move(job["temp_path"], os.path.join(processed_dir, job["filename"]))
+        logger.info(f"✅ Indexed {len(job['chunks'])} semantic chunks for: {job['filename']}")
+
+    async def loader_worker(self):
+        while True:
+            file_path = await self.load_queue.get()
+            try:
+                job = await asyncio.to_thread(self.load_pdf, file_path)
+                if job:
+                    await self.classify_queue.put(job)
+            except Exception:
+                logger.exception(f"❌ Error loading {os.path.basename(file_path)}:")
+            finally:
+                self.load_queue.task_done()
+
+    async def classifier_worker(self):
+        """Stage 2: LLM classification (claims only) and semantic chunking."""
+        while True:
+            job = await self.classify_queue.get()
+            try:
+                parts, is_claim, sample = job["parts"], job["is_claim"], job.pop("sample")
+
+                # Classification (first page only)
+                if is_claim:
+                    category = await self.classify_claim_type(sample, job["filename"])
+                else:
+                    category = parts[-3] 
+
+                # --- SEMANTIC CHUNKING ---
+                # This looks at sentence embeddings and splits when the topic changes
+                chunks = await asyncio.to_thread(self.split_pdf, job)
+                
+                meta_data = {
+                    "source_type": "Claim" if is_claim else "Policy",
+                    "document_category": category,
+                    "client_id": parts[-3] if is_claim else "Company",
+                    "submission_date": parts[-2] if is_claim else "N/A",
+                    "chunk_method": "semantic"
+                }
+
+                for chunk in chunks: 
+                    chunk.metadata.update(meta_data)
+
+                job["chunks"] = chunks
+                await self.embed_queue.put(job)
+            except (httpx.ConnectError, ConnectionError) as e:
+                # Ollama down: the file is restored and retried on its next event
+                logger.warning(f"⚠️ Ollama unreachable while processing {job['filename']}: {e}")
+                self.restore(job)
+            except Exception:
+                logger.exception(f"❌ Error processing {job['filename']}:")
+                self.restore(job)
+            finally:
+                self.classify_queue.task_done()
+
+    async def embedder_worker(self):
+        """Stage 3: embeds and writes chunks from several files in one call per collection."""
+        while True:
+            batch = [await self.embed_queue.get()]
+            pending = len(batch[0]["chunks"])
+            while pending < EMBED_BATCH_SIZE and not self.embed_queue.empty():
+                job = self.embed_queue.get_nowait()
+                batch.append(job)
+                pending += len(job["chunks"])
+
+            try:
+                groups = {}
+                for job in batch:
+                    groups.setdefault(job["is_claim"], []).append(job)
+
+                for is_claim, jobs in groups.items():
+                    try:
+                        await self.index_jobs(claims_db if is_claim else policy_db, jobs)
+                    except Exception:
+                        logger.exception(f"❌ Error indexing {', '.join(job['filename'] for job in jobs)}:")
+            finally:
+                for _ in batch:
+                    self.embed_queue.task_done()
+
+    async def index_jobs(self, db, jobs):
+        """Writes one collection's chunks in a single call, then archives each file."""
+        chunks = [chunk for job in jobs for chunk in job["chunks"]]
+        try:
+            if chunks:
+                await asyncio.to_thread(db.add_documents, chunks)
+        except Exception:
+            for job in jobs:
+                self.restore(job)
+            raise
+
+        for job in jobs:
+            try:
+                self.archive(job)
+            except OSError as e:
+                # Chunks are already committed: leave the .ingesting file in place
+                # rather than restoring it, which would re-ingest duplicates
+                logger.warning(f"⚠️ Indexed but could not archive {job['filename']}: {e}")
 
 if __name__ == "__main__":
     WATCH_PATH = r"D:\pY\InsuranceRAG\storage"
@@ -0,0 +1,98 @@
+import json
+import hashlib
+import threading
+import chromadb
+from cachetools import TTLCache # Required: pip install cachetools
+from chromadb.config import Settings
+from langchain_huggingface import HuggingFaceEmbeddings
+from langchain_chroma import Chroma
+
+# Single home for the Chroma client, embedding model and collection handles.
+# main.py, ai_service.py and processor.py import these instead of opening their
+# own PersistentClient, so each process loads SQLite/HNSW and the encoder once.
+CHROMA_PATH = r"D:\pY\InsuranceRAG\local_db"
+
+# ONNX Runtime backend (Required: pip install "sentence-transformers[onnx]") with
+# batched encoding; vectors stay compatible with the existing fp32 collections.
+EMBEDDINGS = HuggingFaceEmbeddings(
+    model_name="all-MiniLM-L6-v2",
+    model_kwargs={"device": "cpu", "backend": "onnx"},
+    encode_kwargs={"batch_size": 64, "normalize_embeddings": True}
+)
+
+# Built once at import; every module shares this client through the import cache
+CHROMA_CLIENT = chromadb.PersistentClient(
+    path=CHROMA_PATH,
+    settings=Settings(anonymized_telemetry=False, is_persistent=True)
+)
+
+# Per-collection HNSW parameters (applied when a collection is first created).
+# Policies back the quality-sensitive auditor endpoint, so they get a denser graph
+# and a wider search beam; the audit log is only ever read by metadata filter.
+COLLECTION_HNSW = {
+    "policy_master_collection": {"hnsw:construction_ef": 200, "hnsw:M": 32, "hnsw:search_ef": 64},
+    "claims_collection": None,
+    "evaluation_audit_log": {"hnsw:construction_ef": 100}
+}
+
+POLICY_DB = Chroma(
+    client=CHROMA_CLIENT,
+    embedding_function=EMBEDDINGS,
+    collection_name="policy_master_collection",
+    collection_metadata=COLLECTION_HNSW["policy_master_collection"]
+)
+
+CLAIMS_DB = Chroma(
+    client=CHROMA_CLIENT,
+    embedding_function=EMBEDDINGS,
+    collection_name="claims_collection"
+)
+
+EVALUATIONS_DB = Chroma(
+    client=CHROMA_CLIENT,
+    embedding_function=EMBEDDINGS,
+    collection_name="evaluation_audit_log",
+    collection_metadata=COLLECTION_HNSW["evaluation_audit_log"]
+)
+
+# Short-lived result cache shared by every similarity_search call site, so the same
+# (collection, query, k, filter) inside one investigation or across concurrent ones
+# costs one embedding + ANN query per SEARCH_CACHE_TTL window.
+SEARCH_CACHE_TTL = 60  # seconds
+_search_cache = TTLCache(maxsize=1024, ttl=SEARCH_CACHE_TTL)
+_search_lock = threading.Lock()
+
+def _search_key(db, query, k, filt):
+    raw = json.dumps([db._collection_name, query, k, filt], sort_keys=True)
+    return hashlib.blake2b(raw.encode(), digest_size=16).hexdigest()
+
+def _cache_get(key):
+    with _search_lock:
+        return _search_cache.get(key)
+
+def _cache_put(key, docs):
+    with _search_lock:
+        _search_cache[key] = tuple(docs)
+
+def clear_search_cache():
+    """Drops every cached result; call after deleting documents so stale hits are not served."""
+    with _search_lock:
+        _search_cache.clear()
+
+def cached_similarity_search(db, query, k=4, filt=None):
+    """db.similarity_search with a TTL cache in front of it."""
+    key = _search_key(db, query, k, filt)
+    docs = _cache_get(key)
+    if docs is None:
+        docs = db.similarity_search(query, k=k, filter=filt)
+        _cache_put(key, docs)
+    return list(docs)
+
+async def acached_similarity_search(db, query, k=4, filt=None):
+    """Async counterpart of cached_similarity_search (uses db.asimilarity_search)."""
+    key = _search_key(db, query, k, filt)
+    docs = _cache_get(key)
+    if docs is None:
+        docs = await db.asimilarity_search(query, k=k, filter=filt)
+        _cache_put(key, docs)
+    return list(docs)